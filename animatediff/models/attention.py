@@ -28,6 +28,21 @@ else:
     xformers = None
 
 
+def is_sdpa_available():
+    return hasattr(F, "scaled_dot_product_attention")
+
+
+def sdpa_attention(self, query, key, value, attention_mask=None):
+    # drop-in replacement for `CrossAttention._attention` dispatching to pytorch's fused attention kernels
+    # query / key / value are (batch * heads, seq_len, head_dim) and are unflattened to the (batch, heads, seq_len, head_dim)
+    # layout the fused kernels require; the default scale matches `self.scale`
+    query, key, value = (x.unflatten(0, (-1, self.heads)) for x in (query, key, value))
+    if attention_mask is not None: attention_mask = attention_mask.unflatten(0, (-1, self.heads)).to(query.dtype)
+    hidden_states = F.scaled_dot_product_attention(query, key, value, attn_mask=attention_mask)
+    hidden_states = self.reshape_batch_dim_to_heads(hidden_states.flatten(0, 1))
+    return hidden_states
+
+
 class Transformer3DModel(ModelMixin, ConfigMixin):
     @register_to_config
     def __init__(
@@ -5,6 +5,7 @@ from typing import List, Optional, Tuple, Union
 
 import os
 import json
+import types
 import pdb
 
 import torch
@@ -14,7 +15,9 @@ import torch.utils.checkpoint
 from diffusers.configuration_utils import ConfigMixin, register_to_config
 from diffusers.modeling_utils import ModelMixin
 from diffusers.utils import BaseOutput, logging
+from diffusers.models.attention import CrossAttention
 from diffusers.models.embeddings import TimestepEmbedding, Timesteps
+from .attention import is_sdpa_available, sdpa_attention
 from .unet_blocks import (
     CrossAttnDownBlock3D,
     CrossAttnUpBlock3D,
@@ -305,6 +308,20 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
         for module in self.children():
             fn_recursive_set_attention_slice(module, reversed_slice_size)
 
+    def enable_sdpa_attention(self):
+        if not is_sdpa_available():
+            raise ValueError("`torch.nn.functional.scaled_dot_product_attention` is only available for torch>=2.0")
+        # covers both spatial `CrossAttention` and temporal `VersatileAttention` modules
+        for module in self.modules():
+            if isinstance(module, CrossAttention):
+                module._use_memory_efficient_attention_xformers = False
+                module._attention = types.MethodType(sdpa_attention, module)
+
+    def disable_sdpa_attention(self):
+        for module in self.modules():
+            if isinstance(module, CrossAttention):
+                module.__dict__.pop("_attention", None)
+
     def _set_gradient_checkpointing(self, module, value=False):
         if isinstance(module, (CrossAttnDownBlock3D, DownBlock3D, CrossAttnUpBlock3D, UpBlock3D)):
             module.gradient_checkpointing = value
@@ -448,7 +465,7 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
         return UNet3DConditionOutput(sample=sample)
 
     @classmethod
-    def from_pretrained_2d(cls, pretrained_model_path, subfolder=None, unet_additional_kwargs=None):
+    def from_pretrained_2d(cls, pretrained_model_path, subfolder=None, unet_additional_kwargs=None, torch_dtype=None):
         if subfolder is not None:
             pretrained_model_path = os.path.join(pretrained_model_path, subfolder)
         print(f"loaded temporal unet's pretrained weights from {pretrained_model_path} ...")
@@ -485,5 +502,8 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
         
         params = [p.numel() if "temporal" in n else 0 for n, p in model.named_parameters()]
         print(f"### Temporal Module Parameters: {sum(params) / 1e6} M")
+
+        if torch_dtype is not None:
+            model = model.to(dtype=torch_dtype)
         
         return model
@@ -6,7 +6,6 @@ from dataclasses import dataclass
 
 import numpy as np
 import torch
-from tqdm import tqdm
 
 from diffusers.utils import is_accelerate_available
 from packaging import version
@@ -115,12 +114,28 @@ class AnimationPipeline(DiffusionPipeline):
         )
         self.vae_scale_factor = 2 ** (len(self.vae.config.block_out_channels) - 1)
 
+        # optional dict mapping (id(text_encoder), texts) to text embeddings, owned and invalidated by the caller
+        self.text_embeddings_cache = None
+        self.text_embeddings_cache_size = 64
+
+        # cuda graphs of a single unet step, keyed by input shapes; None means eager execution
+        self.cuda_graphs = None
+        self.cuda_graph_pool = None
+
     def enable_vae_slicing(self):
         self.vae.enable_slicing()
 
     def disable_vae_slicing(self):
         self.vae.disable_slicing()
 
+    def enable_cuda_graph(self):
+        self.cuda_graphs = {}
+        self.cuda_graph_pool = None
+
+    def disable_cuda_graph(self):
+        self.cuda_graphs = None
+        self.cuda_graph_pool = None
+
     def enable_sequential_cpu_offload(self, gpu_id=0):
         if is_accelerate_available():
             from accelerate import cpu_offload
@@ -147,6 +162,60 @@ class AnimationPipeline(DiffusionPipeline):
                 return torch.device(module._hf_hook.execution_device)
         return self.device
 
+    def _capture_unet_graph(self, static_inputs):
+        sample, timestep, encoder_hidden_states = static_inputs
+
+        # warm up on a side stream before capturing, as required by cuda graphs
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(2):
+                self.unet(sample, timestep, encoder_hidden_states=encoder_hidden_states)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        # graphs of all shapes share one memory pool; outputs are cloned right after each replay
+        if self.cuda_graph_pool is None:
+            self.cuda_graph_pool = torch.cuda.graph_pool_handle()
+        graph = torch.cuda.CUDAGraph()
+        autocast_kwargs = dict(dtype=torch.get_autocast_gpu_dtype(), enabled=torch.is_autocast_enabled(), cache_enabled=False)
+        with torch.cuda.graph(graph, pool=self.cuda_graph_pool), torch.autocast("cuda", **autocast_kwargs):
+            static_output = self.unet(sample, timestep, encoder_hidden_states=encoder_hidden_states).sample
+        return graph, static_output
+
+    def _unet_forward(self, sample, timestep, encoder_hidden_states):
+        if self.cuda_graphs is None or not torch.is_tensor(timestep):
+            return self.unet(sample, timestep, encoder_hidden_states=encoder_hidden_states).sample
+
+        inputs = (sample, timestep, encoder_hidden_states)
+        graph_key = tuple((x.shape, x.dtype) for x in inputs)
+        if graph_key not in self.cuda_graphs:
+            static_inputs = [x.clone() for x in inputs]
+            self.cuda_graphs[graph_key] = (static_inputs, *self._capture_unet_graph(static_inputs))
+
+        static_inputs, graph, static_output = self.cuda_graphs[graph_key]
+        for static_input, x in zip(static_inputs, inputs):
+            static_input.copy_(x)
+        graph.replay()
+        return static_output.clone()
+
+    def _get_text_embeddings(self, texts, input_ids, attention_mask, device):
+        cache = self.text_embeddings_cache
+        cache_key = (id(self.text_encoder), tuple(texts))
+        if cache is not None and cache_key in cache:
+            return cache[cache_key]
+
+        text_embeddings = self.text_encoder(
+            input_ids.to(device),
+            attention_mask=attention_mask,
+        )
+        text_embeddings = text_embeddings[0]
+
+        if cache is not None:
+            if len(cache) >= self.text_embeddings_cache_size:
+                cache.pop(next(iter(cache)))
+            cache[cache_key] = text_embeddings
+        return text_embeddings
+
     def _encode_prompt(self, prompt, device, num_videos_per_prompt, do_classifier_free_guidance, negative_prompt):
         batch_size = len(prompt) if isinstance(prompt, list) else 1
 
@@ -172,11 +241,7 @@ class AnimationPipeline(DiffusionPipeline):
         else:
             attention_mask = None
 
-        text_embeddings = self.text_encoder(
-            text_input_ids.to(device),
-            attention_mask=attention_mask,
-        )
-        text_embeddings = text_embeddings[0]
+        text_embeddings = self._get_text_embeddings(prompt if isinstance(prompt, list) else [prompt], text_input_ids, attention_mask, device)
 
         # duplicate text embeddings for each generation per prompt, using mps friendly method
         bs_embed, seq_len, _ = text_embeddings.shape
@@ -218,11 +283,7 @@ class AnimationPipeline(DiffusionPipeline):
             else:
                 attention_mask = None
 
-            uncond_embeddings = self.text_encoder(
-                uncond_input.input_ids.to(device),
-                attention_mask=attention_mask,
-            )
-            uncond_embeddings = uncond_embeddings[0]
+            uncond_embeddings = self._get_text_embeddings(uncond_tokens, uncond_input.input_ids, attention_mask, device)
 
             # duplicate unconditional embeddings for each generation per prompt, using mps friendly method
             seq_len = uncond_embeddings.shape[1]
@@ -240,17 +301,26 @@ class AnimationPipeline(DiffusionPipeline):
         video_length = latents.shape[2]
         latents = 1 / 0.18215 * latents
         latents = rearrange(latents, "b c f h w -> (b f) c h w")
-        # video = self.vae.decode(latents).sample
-        video = []
-        for frame_idx in tqdm(range(latents.shape[0])):
-            video.append(self.vae.decode(latents[frame_idx:frame_idx+1]).sample)
-        video = torch.cat(video)
+        # one decoder call per video bounds activation memory for batched requests; enable vae slicing to decode frame by frame
+        video = torch.cat([self._decode_frames(frames) for frames in latents.split(video_length)])
         video = rearrange(video, "(b f) c h w -> b c f h w", f=video_length)
         video = (video / 2 + 0.5).clamp(0, 1)
         # we always cast to float32 as this does not cause significant overhead and is compatible with bfloa16
         video = video.cpu().float().numpy()
         return video
 
+    def _decode_frames(self, latents):
+        frames = self.vae.decode(latents.to(dtype=self.vae.dtype)).sample
+        if self.vae.dtype == torch.float16 and not torch.isfinite(frames).all():
+            # the fp16 decoder overflows on some base models, redo these frames in fp32 outside of autocast
+            with torch.autocast(latents.device.type, enabled=False):
+                self.vae.to(dtype=torch.float32)
+                try:
+                    frames = self.vae.decode(latents.float()).sample
+                finally:
+                    self.vae.to(dtype=torch.float16)
+        return frames.float()
+
     def prepare_extra_step_kwargs(self, generator, eta):
         # prepare extra kwargs for the scheduler step, since not all schedulers have the same signature
         # eta (η) is only used with the DDIMScheduler, it will be ignored for other schedulers.
@@ -265,7 +335,8 @@ class AnimationPipeline(DiffusionPipeline):
         # check if the scheduler accepts generator
         accepts_generator = "generator" in set(inspect.signature(self.scheduler.step).parameters.keys())
         if accepts_generator:
-            extra_step_kwargs["generator"] = generator
+            # scheduler steps draw their noise for the whole batch from a single generator
+            extra_step_kwargs["generator"] = generator[0] if isinstance(generator, list) else generator
         return extra_step_kwargs
 
     def check_inputs(self, prompt, height, width, callback_steps):
@@ -294,8 +365,7 @@ class AnimationPipeline(DiffusionPipeline):
             rand_device = "cpu" if device.type == "mps" else device
 
             if isinstance(generator, list):
-                shape = shape
-                # shape = (1,) + shape[1:]
+                shape = (1,) + shape[1:]
                 latents = [
                     torch.randn(shape, generator=generator[i], device=rand_device, dtype=dtype)
                     for i in range(batch_size)
@@ -330,6 +400,8 @@ class AnimationPipeline(DiffusionPipeline):
         return_dict: bool = True,
         callback: Optional[Callable[[int, int, torch.FloatTensor], None]] = None,
         callback_steps: Optional[int] = 1,
+        residual_cfg: bool = False,
+        residual_cfg_alpha: float = 1.0,
         **kwargs,
     ):
         # Default height and width to unet
@@ -366,6 +438,7 @@ class AnimationPipeline(DiffusionPipeline):
         timesteps = self.scheduler.timesteps
 
         # Prepare latent variables
+        # latents and scheduler math are kept in fp32 even when the unet runs in half precision
         num_channels_latents = self.unet.in_channels
         latents = self.prepare_latents(
             batch_size * num_videos_per_prompt,
@@ -373,7 +446,7 @@ class AnimationPipeline(DiffusionPipeline):
             video_length,
             height,
             width,
-            text_embeddings.dtype,
+            torch.float32,
             device,
             generator,
             latents,
@@ -383,16 +456,25 @@ class AnimationPipeline(DiffusionPipeline):
         # Prepare extra step kwargs.
         extra_step_kwargs = self.prepare_extra_step_kwargs(generator, eta)
 
+        # Residual CFG: the unconditional prediction is only computed at the first step and afterwards
+        # approximated as `eps_u_0 + alpha * (eps_c - eps_c_0)`, halving the unet batch of later steps
+        cond_text_embeddings = text_embeddings.chunk(2)[1] if do_classifier_free_guidance else text_embeddings
+        noise_pred_uncond_0 = noise_pred_text_0 = None
+
         # Denoising loop
         num_warmup_steps = len(timesteps) - num_inference_steps * self.scheduler.order
         with self.progress_bar(total=num_inference_steps) as progress_bar:
             for i, t in enumerate(timesteps):
                 # expand the latents if we are doing classifier free guidance
-                latent_model_input = torch.cat([latents] * 2) if do_classifier_free_guidance else latents
+                do_full_guidance = do_classifier_free_guidance and not (residual_cfg and i > 0)
+                latent_model_input = torch.cat([latents] * 2) if do_full_guidance else latents
                 latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
+                step_text_embeddings = text_embeddings if do_full_guidance else cond_text_embeddings
 
                 # predict the noise residual
-                noise_pred = self.unet(latent_model_input, t, encoder_hidden_states=text_embeddings).sample.to(dtype=latents_dtype)
+                noise_pred = self._unet_forward(
+                    latent_model_input.to(dtype=self.unet.dtype), t, step_text_embeddings.to(dtype=self.unet.dtype)
+                ).to(dtype=latents_dtype)
                 # noise_pred = []
                 # import pdb
                 # pdb.set_trace()
@@ -402,8 +484,13 @@ class AnimationPipeline(DiffusionPipeline):
                 # noise_pred = torch.cat(noise_pred)
 
                 # perform guidance
-                if do_classifier_free_guidance:
+                if do_full_guidance:
                     noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
+                    noise_pred_uncond_0, noise_pred_text_0 = noise_pred_uncond, noise_pred_text
+                elif do_classifier_free_guidance:
+                    noise_pred_text = noise_pred
+                    noise_pred_uncond = noise_pred_uncond_0 + residual_cfg_alpha * (noise_pred_text - noise_pred_text_0)
+                if do_classifier_free_guidance:
                     noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_text - noise_pred_uncond)
 
                 # compute the previous noisy sample x_t -> x_t-1
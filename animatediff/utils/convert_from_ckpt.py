@@ -325,6 +325,22 @@ def create_ldm_bert_config(original_config):
     return config
 
 
+def split_sd_checkpoint(checkpoint):
+    """
+    Partitions an original stable diffusion checkpoint into vae / unet / text encoder state dicts in a single pass.
+    Keys keep their original prefixes, so each part can be passed to the matching `convert_ldm_*` function.
+    """
+    vae_state_dict, unet_state_dict, clip_state_dict = {}, {}, {}
+    for key, value in checkpoint.items():
+        if key.startswith("first_stage_model."):
+            vae_state_dict[key] = value
+        elif key.startswith("model.diffusion_model."):
+            unet_state_dict[key] = value
+        elif key.startswith("cond_stage_model."):
+            clip_state_dict[key] = value
+    return vae_state_dict, unet_state_dict, clip_state_dict
+
+
 def convert_ldm_unet_checkpoint(checkpoint, config, path=None, extract_ema=False, controlnet=False):
     """
     Takes a state dict and a config, and returns a converted checkpoint.
@@ -2,23 +2,32 @@
 import os
 import torch
 import random
+import inspect
+import hashlib
+import tempfile
 
 import gradio as gr
 from glob import glob
+from packaging import version
 from omegaconf import OmegaConf
 from safetensors import safe_open
+from safetensors.torch import save_file
 
 from diffusers import AutoencoderKL
-from diffusers import EulerDiscreteScheduler
+from diffusers import EulerDiscreteScheduler, DPMSolverMultistepScheduler
 from diffusers.utils.import_utils import is_xformers_available
 from transformers import CLIPTextModel, CLIPTokenizer
 
 from animatediff.models.unet import UNet3DConditionModel
+from animatediff.models.attention import is_sdpa_available
+from animatediff.models.resnet import InflatedConv3d
 from animatediff.pipelines.pipeline_animation import AnimationPipeline
 from animatediff.utils.util import save_videos_grid
-from animatediff.utils.convert_from_ckpt import convert_ldm_unet_checkpoint, convert_ldm_clip_checkpoint, convert_ldm_vae_checkpoint
+from animatediff.utils.convert_from_ckpt import convert_ldm_unet_checkpoint, convert_ldm_vae_checkpoint, split_sd_checkpoint
 
 
+torch.backends.cudnn.benchmark = True
+
 pretrained_model_path = "models/StableDiffusion/stable-diffusion-v1-5"
 inference_config_path = "configs/inference/inference.yaml"
 
@@ -31,6 +40,10 @@ css = """
 }
 """
 
+def sub_state_dict(state_dict, prefix):
+    return {k[len(prefix):]: v for k, v in state_dict.items() if k.startswith(prefix)}
+
+
 class AnimateController:
     def __init__(self):
         
@@ -40,29 +53,118 @@ class AnimateController:
         self.motion_module_dir      = os.path.join(self.basedir, "models", "Motion_Module")
         self.personalized_model_dir = os.path.join(self.basedir, "models", "DreamBooth_LoRA")
         self.savedir                = os.path.join(self.basedir, "samples")
+        self.conversion_cache_dir   = os.path.join(self.basedir, "models", "_converted_cache")
         os.makedirs(self.savedir, exist_ok=True)
+        os.makedirs(self.conversion_cache_dir, exist_ok=True)
 
         self.base_model_list    = []
         self.motion_module_list = []
         
         self.selected_base_model    = None
         self.selected_motion_module = None
+
+        self.text_embeddings_cache  = {}
         
         self.refresh_motion_module()
         self.refresh_personalized_model()
         
         # config models
         self.inference_config      = OmegaConf.load(inference_config_path)
+        self.noise_scheduler_kwargs = OmegaConf.to_container(self.inference_config.noise_scheduler_kwargs, resolve=True)
+        self.unet_additional_kwargs = OmegaConf.to_container(self.inference_config.unet_additional_kwargs, resolve=True)
+        self.dtype                 = torch.float16
+        self.quantize              = self.inference_config.get("quantize", None)
+        self.use_sdpa              = is_sdpa_available()
+        self.max_batch_size        = 4
 
         self.tokenizer             = CLIPTokenizer.from_pretrained(pretrained_model_path, subfolder="tokenizer")
-        self.text_encoder          = CLIPTextModel.from_pretrained(pretrained_model_path, subfolder="text_encoder").cuda()
-        self.vae                   = AutoencoderKL.from_pretrained(pretrained_model_path, subfolder="vae").cuda()
-        self.unet                  = UNet3DConditionModel.from_pretrained_2d(pretrained_model_path, subfolder="unet", unet_additional_kwargs=OmegaConf.to_container(self.inference_config.unet_additional_kwargs)).cuda()
+        self.text_encoder          = CLIPTextModel.from_pretrained(pretrained_model_path, subfolder="text_encoder", torch_dtype=self.dtype).cuda()
+        self.vae                   = AutoencoderKL.from_pretrained(pretrained_model_path, subfolder="vae", torch_dtype=self.dtype).cuda()
+        # decode in tiles for resolutions above 512 when supported, vae slicing is toggled per call
+        if hasattr(self.vae, "enable_tiling"): self.vae.enable_tiling()
+        # no cudagraphs: sliced and tiled decoding keep earlier decoder outputs alive across calls
+        if hasattr(torch, "compile"): self.vae.decoder.forward = torch.compile(self.vae.decoder.forward, mode="max-autotune-no-cudagraphs", fullgraph=False)
+        self.unet                  = self.build_unet()
+        self.unet_quantized        = False
+
+        # optionally keep every converted base model in pinned host memory for fast switching
+        self.base_model_cache      = {}
+        if self.inference_config.get("preload_all", False):
+            for base_model in self.base_model_list:
+                self.base_model_cache[base_model] = {k: v.cpu().pin_memory() for k, v in self.load_base_model(base_model, device="cpu").items()}
         
-        self.update_base_model(self.base_model_list[0])
-        self.update_motion_module(self.motion_module_list[0])
+        self.update_models(self.base_model_list[0], self.motion_module_list[0])
+
+        # submodules are only ever updated in-place, so the pipeline and schedulers are built once
+        dpm_solver_kwargs          = dict(algorithm_type="dpmsolver++", solver_order=2)
+        if "use_karras_sigmas" in inspect.signature(DPMSolverMultistepScheduler.__init__).parameters: dpm_solver_kwargs["use_karras_sigmas"] = True
+        self.schedulers            = {
+            "DPM++ 2M": DPMSolverMultistepScheduler(**self.noise_scheduler_kwargs, **dpm_solver_kwargs),
+            "Euler":    EulerDiscreteScheduler(**self.noise_scheduler_kwargs),
+        }
+        self.pipeline              = AnimationPipeline(
+            vae=self.vae, text_encoder=self.text_encoder, tokenizer=self.tokenizer, unet=self.unet, scheduler=self.schedulers["DPM++ 2M"],
+        )
+        self.pipeline.text_embeddings_cache = self.text_embeddings_cache
+
+        self.prepare_unet()
+        if hasattr(torch, "compile"): self.warmup_vae()
         
         
+    def build_unet(self):
+        return UNet3DConditionModel.from_pretrained_2d(pretrained_model_path, subfolder="unet", unet_additional_kwargs=self.unet_additional_kwargs, torch_dtype=self.dtype).cuda()
+
+    def prepare_unet(self):
+        # route attention through pytorch's fused sdpa kernels, xformers is only a fallback
+        if self.use_sdpa: self.unet.enable_sdpa_attention()
+        elif is_xformers_available(): self.unet.enable_xformers_memory_efficient_attention()
+
+        # InflatedConv3d runs 2d convolutions over (b f) c h w, so nhwc (not ndhwc) is the layout cudnn sees
+        self.unet.to(memory_format=torch.channels_last)
+
+        # quantize only once the base model / motion module weights are loaded
+        if self.quantize is not None: self.quantize_unet()
+
+        # compile the unet forward once; weights are still loaded in-place on `self.unet`
+        if hasattr(torch, "compile"):
+            import torch._inductor.config
+            torch._inductor.config.conv_1x1_as_mm = True
+            torch._inductor.config.coordinate_descent_tuning = True
+            self.unet.forward = torch.compile(self.unet.forward, mode="reduce-overhead", fullgraph=False)
+            self.warmup_unet()
+        # "reduce-overhead" already replays cuda graphs, otherwise capture the unet step in the pipeline
+        else:
+            self.pipeline.enable_cuda_graph()
+
+        self.pipeline.unet = self.unet
+
+    def quantize_unet(self):
+        try:
+            from optimum.quanto import freeze, qfloat8, qint8, quantize
+        except ImportError:
+            raise ImportError("Please install optimum-quanto via `pip install optimum-quanto`")
+
+        # InflatedConv3d folds frames into the batch around its Conv2d forward, which quanto's QConv2d would drop
+        exclude = [name for name, module in self.unet.named_modules() if isinstance(module, InflatedConv3d)]
+        quantize(self.unet, weights={"int8": qint8, "fp8": qfloat8}[self.quantize], exclude=exclude)
+        freeze(self.unet)
+        self.unet_quantized = True
+
+    def rebuild_quantized_unet(self, base_model_unet_state_dict=None, motion_module_state_dict=None):
+        # frozen quantized weights cannot be overwritten in-place, so rebuild the unet
+        # from the selected base model and motion module and quantize it again
+        self.unet = self.pipeline.unet = None
+        torch.cuda.empty_cache()
+
+        self.unet = self.build_unet()
+        self.unet_quantized = False
+        if base_model_unet_state_dict is None: base_model_unet_state_dict = sub_state_dict(self.get_base_model(self.selected_base_model), "unet.")
+        if motion_module_state_dict is None: motion_module_state_dict = self.load_motion_module(self.selected_motion_module)
+        self.unet.load_state_dict(base_model_unet_state_dict, strict=False)
+        _, unexpected = self.unet.load_state_dict(motion_module_state_dict, strict=False)
+        assert len(unexpected) == 0
+        self.prepare_unet()
+
     def refresh_motion_module(self):
         motion_module_list = glob(os.path.join(self.motion_module_dir, "*.ckpt"))
         self.motion_module_list = [os.path.basename(p) for p in motion_module_list]
@@ -73,32 +175,115 @@ class AnimateController:
 
 
     def update_base_model(self, base_model_dropdown):
-        self.selected_base_model = base_model_dropdown
-        
+        self.update_models(base_model_dropdown=base_model_dropdown)
+        return gr.Dropdown.update()
+
+    def update_motion_module(self, motion_module_dropdown):
+        self.update_models(motion_module_dropdown=motion_module_dropdown)
+        return gr.Dropdown.update()
+
+    def update_models(self, base_model_dropdown=None, motion_module_dropdown=None):
+        # applies the given selections (None keeps the current one) with at most one quantized unet rebuild
+        base_model_unet_state_dict = motion_module_state_dict = None
+        if base_model_dropdown is not None:
+            self.selected_base_model = base_model_dropdown
+            converted_state_dict = self.get_base_model(base_model_dropdown)
+            self.vae.load_state_dict(sub_state_dict(converted_state_dict, "vae."))
+            self.text_encoder.load_state_dict(sub_state_dict(converted_state_dict, "text_encoder."))
+            self.text_embeddings_cache.clear()
+            base_model_unet_state_dict = sub_state_dict(converted_state_dict, "unet.")
+            del converted_state_dict
+
+        if motion_module_dropdown is not None:
+            self.selected_motion_module = motion_module_dropdown
+            motion_module_state_dict = self.load_motion_module(motion_module_dropdown)
+
+        if self.unet_quantized:
+            self.rebuild_quantized_unet(base_model_unet_state_dict, motion_module_state_dict)
+            return
+
+        if base_model_unet_state_dict is not None:
+            self.unet.load_state_dict(base_model_unet_state_dict, strict=False)
+        if motion_module_state_dict is not None:
+            _, unexpected = self.unet.load_state_dict(motion_module_state_dict, strict=False)
+            assert len(unexpected) == 0
+
+    def get_base_model(self, base_model_dropdown):
+        if base_model_dropdown in self.base_model_cache: return self.base_model_cache[base_model_dropdown]
+        return self.load_base_model(base_model_dropdown)
+
+    def load_base_model(self, base_model_dropdown, device="cuda"):
         base_model_dropdown = os.path.join(self.personalized_model_dir, base_model_dropdown)
+        # one cache entry per checkpoint path, the source mtime is stored in the metadata so that
+        # a changed checkpoint overwrites its stale entry instead of leaving it behind
+        cache_key  = hashlib.sha1(base_model_dropdown.encode()).hexdigest()
+        cache_path = os.path.join(self.conversion_cache_dir, f"{cache_key}.safetensors")
+        mtime      = str(os.path.getmtime(base_model_dropdown))
+
+        if os.path.isfile(cache_path):
+            with safe_open(cache_path, framework="pt", device=device) as f:
+                if (f.metadata() or {}).get("mtime") == mtime:
+                    return {key: f.get_tensor(key) for key in f.keys()}
+
+        converted_state_dict = self.convert_base_model(base_model_dropdown)
+        # write next to the final path and rename, so an interrupted write never leaves a truncated cache hit
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.conversion_cache_dir)
+        os.close(fd)
+        try:
+            save_file({k: v.contiguous() for k, v in converted_state_dict.items()}, tmp_path, metadata={"mtime": mtime})
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+        return converted_state_dict
+
+    def convert_base_model(self, base_model_path):
+        # returns the diffusers state dicts of the vae / unet / text encoder merged under per-module prefixes
+        # read tensors straight into gpu memory and skip the ones that are never converted (e.g. ema weights)
         base_model_state_dict = {}
-        with safe_open(base_model_dropdown, framework="pt", device="cpu") as f:
-            for key in f.keys(): base_model_state_dict[key] = f.get_tensor(key)
+        with safe_open(base_model_path, framework="pt", device="cuda") as f:
+            for key in f.keys():
+                if key.startswith(("first_stage_model.", "model.diffusion_model.", "cond_stage_model.")):
+                    base_model_state_dict[key] = f.get_tensor(key)
                 
-        converted_vae_checkpoint = convert_ldm_vae_checkpoint(base_model_state_dict, self.vae.config)
-        self.vae.load_state_dict(converted_vae_checkpoint)
-
-        converted_unet_checkpoint = convert_ldm_unet_checkpoint(base_model_state_dict, self.unet.config)
-        self.unet.load_state_dict(converted_unet_checkpoint, strict=False)
+        vae_state_dict, unet_state_dict, clip_state_dict = split_sd_checkpoint(base_model_state_dict)
+        converted_vae_checkpoint  = convert_ldm_vae_checkpoint(vae_state_dict, self.vae.config)
+        converted_unet_checkpoint = convert_ldm_unet_checkpoint(unet_state_dict, self.unet.config)
+        # same renaming as `convert_ldm_clip_checkpoint`, without instantiating a throwaway CLIPTextModel
+        converted_clip_checkpoint = sub_state_dict(clip_state_dict, "cond_stage_model.transformer.")
 
-        self.text_encoder = convert_ldm_clip_checkpoint(base_model_state_dict)
-        return gr.Dropdown.update()
+        converted_state_dict = {}
+        for prefix, state_dict in [("vae.", converted_vae_checkpoint), ("unet.", converted_unet_checkpoint), ("text_encoder.", converted_clip_checkpoint)]:
+            converted_state_dict.update({prefix + k: v for k, v in state_dict.items()})
+        return converted_state_dict
 
-    def update_motion_module(self, motion_module_dropdown):
-        self.selected_motion_module = motion_module_dropdown
-        
+    def load_motion_module(self, motion_module_dropdown):
         motion_module_dropdown = os.path.join(self.motion_module_dir, motion_module_dropdown)
-        motion_module_state_dict = torch.load(motion_module_dropdown, map_location="cpu")
-        _, unexpected = self.unet.load_state_dict(motion_module_state_dict, strict=False)
-        assert len(unexpected) == 0
-        return gr.Dropdown.update()
+        # memory-map the checkpoint and skip arbitrary unpickling, tensors are paged in while copied to the unet
+        if version.parse(torch.__version__) >= version.parse("2.1"):
+            return torch.load(motion_module_dropdown, map_location="cpu", mmap=True, weights_only=True)
+        return torch.load(motion_module_dropdown, map_location="cpu")
     
     
+    def warmup_unet(self, width=512, height=512, video_length=16):
+        # run a few dummy steps for every unet batch size `animate_batch()` dispatches so that compilation and
+        # cuda graph recording are not paid inside a request: two per request with cfg, one after the first rcfg step
+        batch_sizes = {2 * n for n in range(1, self.max_batch_size + 1)}
+        if self.inference_config.get("use_rcfg", False): batch_sizes |= set(range(1, self.max_batch_size + 1))
+
+        timestep = torch.tensor(999., device="cuda")
+        with torch.inference_mode(), torch.autocast("cuda", dtype=self.dtype):
+            for batch_size in sorted(batch_sizes):
+                latents         = torch.randn(batch_size, self.unet.in_channels, video_length, height // 8, width // 8, device="cuda", dtype=self.dtype)
+                text_embeddings = torch.randn(batch_size, self.tokenizer.model_max_length, self.text_encoder.config.hidden_size, device="cuda", dtype=self.dtype)
+                for _ in range(3): self.unet(latents, timestep, encoder_hidden_states=text_embeddings)
+
+    def warmup_vae(self, width=512, height=512, video_length=16):
+        # compile the decoder for the per-video batch `decode_latents` uses and for the single-frame batch of vae slicing
+        with torch.inference_mode(), torch.autocast("cuda", dtype=self.dtype):
+            for batch_size in (video_length, 1):
+                latents = torch.randn(batch_size, self.vae.config.latent_channels, height // 8, width // 8, device="cuda", dtype=self.dtype)
+                self.vae.decode(latents)
+
     def animate(
         self,
         base_model_dropdown,
@@ -108,44 +293,103 @@ class AnimateController:
         width_slider,
         height_slider,
         seed_textbox,
+        sampler_dropdown,
+        sample_step_slider,
     ):
-        if self.selected_base_model != base_model_dropdown: self.update_base_model(base_model_dropdown)
-        if self.selected_motion_module != motion_module_dropdown: self.update_motion_module(motion_module_dropdown)
-        
-        if is_xformers_available(): self.unet.enable_xformers_memory_efficient_attention()
+        save_sample_paths, json_configs = self.animate_batch(
+            [base_model_dropdown], [motion_module_dropdown], [prompt_textbox], [negative_prompt_textbox],
+            [width_slider], [height_slider], [seed_textbox], [sampler_dropdown], [sample_step_slider],
+        )
+        return gr.Video.update(value=save_sample_paths[0]), gr.Json.update(value=json_configs[0])
 
-        pipeline = AnimationPipeline(
-            vae=self.vae, text_encoder=self.text_encoder, tokenizer=self.tokenizer, unet=self.unet,
-            scheduler=EulerDiscreteScheduler(**OmegaConf.to_container(self.inference_config.noise_scheduler_kwargs))
-        ).to("cuda")
-        
-        if int(seed_textbox) > 0: torch.manual_seed(int(seed_textbox) & ((1<<63)-1))
-        else: torch.seed()
-        seed = torch.initial_seed()
-        
-        sample = pipeline(
-            prompt_textbox,
-            negative_prompt     = negative_prompt_textbox,
-            num_inference_steps = 25,
-            guidance_scale      = 8.,
-            width               = width_slider,
-            height              = height_slider,
-            video_length        = 16,
-        ).videos
-
-        save_sample_path = os.path.join(self.savedir, f"sample.mp4")
-        save_videos_grid(sample, save_sample_path)
-    
-        json_config = {
-            "prompt": prompt_textbox,
-            "n_prompt": negative_prompt_textbox,
-            "width": width_slider,
-            "height": height_slider,
-            "seed": seed,
-            "base_model": base_model_dropdown,
-            "motion_module": motion_module_dropdown,
-        }
-        return gr.Video.update(value=save_sample_path), gr.Json.update(value=json_config)
+    def animate_batch(
+        self,
+        base_model_dropdowns,
+        motion_module_dropdowns,
+        prompt_textboxes,
+        negative_prompt_textboxes,
+        width_sliders,
+        height_sliders,
+        seed_textboxes,
+        sampler_dropdowns,
+        sample_step_sliders,
+    ):
+        # queued requests sharing models, resolution and sampler settings are denoised as one batch
+        groups = {}
+        for idx, group_key in enumerate(zip(base_model_dropdowns, motion_module_dropdowns, width_sliders, height_sliders, sampler_dropdowns, sample_step_sliders)):
+            groups.setdefault(group_key, []).append(idx)
+
+        save_sample_paths = [None] * len(prompt_textboxes)
+        json_configs      = [None] * len(prompt_textboxes)
+        errors            = {}
+        for (base_model_dropdown, motion_module_dropdown, width_slider, height_slider, sampler_dropdown, sample_step_slider), indices in groups.items():
+            self.update_models(
+                base_model_dropdown    if self.selected_base_model    != base_model_dropdown    else None,
+                motion_module_dropdown if self.selected_motion_module != motion_module_dropdown else None,
+            )
+
+            self.pipeline.scheduler = self.schedulers[sampler_dropdown]
+
+            # decode each video in a single batch up to 512, one frame at a time above to bound vram
+            if max(width_slider, height_slider) > 512: self.vae.enable_slicing()
+            else: self.vae.disable_slicing()
+
+            # per-request seeds, resolved once so that a retried request is sampled with the same seed
+            seeds = {}
+            for idx in indices:
+                if int(seed_textboxes[idx]) > 0: seeds[idx] = int(seed_textboxes[idx]) & ((1<<63)-1)
+                else: seeds[idx] = torch.Generator(device="cuda").seed()
+
+            # keep each denoising batch within the pixel count of four 512x512 requests to bound vram
+            sub_batch_size = min(self.max_batch_size, max(1, (512 * 512 * 4) // int(width_slider * height_slider)))
+            pending = [indices[i:i + sub_batch_size] for i in range(0, len(indices), sub_batch_size)]
+            while pending:
+                batch_indices = pending.pop(0)
+
+                # per-request generators avoid reseeding the global cpu / cuda rng state
+                generators = [torch.Generator(device="cuda").manual_seed(seeds[idx]) for idx in batch_indices]
+
+                try:
+                    with torch.inference_mode(), torch.autocast("cuda", dtype=self.dtype):
+                        samples = self.pipeline(
+                            [prompt_textboxes[idx] for idx in batch_indices],
+                            negative_prompt     = [negative_prompt_textboxes[idx] for idx in batch_indices],
+                            num_inference_steps = int(sample_step_slider),
+                            guidance_scale      = 8.,
+                            width               = width_slider,
+                            height              = height_slider,
+                            video_length        = 16,
+                            generator           = generators,
+                            residual_cfg        = self.inference_config.get("use_rcfg", False),
+                        ).videos
+                except Exception as e:
+                    torch.cuda.empty_cache()
+                    # retry a failed batch one request at a time, a request that fails alone only fails itself
+                    if len(batch_indices) > 1: pending = [[idx] for idx in batch_indices] + pending
+                    else: errors[batch_indices[0]] = e
+                    continue
+
+                for sample, idx in zip(samples, batch_indices):
+                    save_sample_path = os.path.join(self.savedir, f"sample-{idx}.mp4")
+                    save_videos_grid(sample.unsqueeze(0), save_sample_path)
+
+                    save_sample_paths[idx] = save_sample_path
+                    json_configs[idx] = {
+                        "prompt": prompt_textboxes[idx],
+                        "n_prompt": negative_prompt_textboxes[idx],
+                        "width": width_slider,
+                        "height": height_slider,
+                        "seed": seeds[idx],
+                        "sampler": sampler_dropdown,
+                        "steps": int(sample_step_slider),
+                        "base_model": base_model_dropdown,
+                        "motion_module": motion_module_dropdown,
+                    }
+
+        # surface the error as usual when no request succeeded, otherwise report it in the failed request's config
+        if len(errors) == len(prompt_textboxes): raise next(iter(errors.values()))
+        for idx, e in errors.items(): json_configs[idx] = {"error": f"{type(e).__name__}: {e}"}
+        return save_sample_paths, json_configs
         
 
 controller = AnimateController()
@@ -193,6 +437,9 @@ def ui():
                         seed_textbox = gr.Textbox( label="Seed",  value=-1)
                         seed_button  = gr.Button(value="\U0001F3B2", elem_classes="toolbutton")
                         seed_button.click(fn=lambda: gr.Textbox.update(value=random.randint(1, 1e16)), inputs=[], outputs=[seed_textbox])
+                    with gr.Row():
+                        sampler_dropdown   = gr.Dropdown( label="Sampling Method", choices=list(controller.schedulers.keys()), value="DPM++ 2M", interactive=True )
+                        sample_step_slider = gr.Slider(   label="Sampling Steps",  value=15, minimum=10, maximum=50, step=1 )
 
                 generate_button = gr.Button( value="Generate", variant='primary' )
 
@@ -201,7 +448,9 @@ def ui():
                 json_config  = gr.Json( label="Config", value=None )
 
                 generate_button.click(
-                    fn=controller.animate, 
+                    fn=controller.animate_batch, 
+                    batch=True,
+                    max_batch_size=controller.max_batch_size,
                     inputs=[
                         base_model_dropdown, 
                         motion_module_dropdown, 
@@ -209,7 +458,9 @@ def ui():
                         negative_prompt_textbox, 
                         width_slider, 
                         height_slider, 
-                        seed_textbox
+                        seed_textbox,
+                        sampler_dropdown,
+                        sample_step_slider,
                     ], 
                     outputs=[
                         result_video, 
@@ -226,7 +477,8 @@ def ui():
                     "mm_sd_v14.ckpt", 
                     "masterpiece, best quality, 1girl, solo, cherry blossoms, hanami, pink flower, white flower, spring season, wisteria, petals, flower, plum blossoms, outdoors, falling petals, white hair, black eyes",
                     "worst quality, low quality, nsfw, logo",
-                    512, 512, "13204175718326964000"
+                    512, 512, "13204175718326964000",
+                    "Euler", 25
                 ],
                 # 2-Lyriel
                 [
@@ -234,7 +486,8 @@ def ui():
                     "mm_sd_v15.ckpt", 
                     "A forbidden castle high up in the mountains, pixel art, intricate details2, hdr, intricate details, hyperdetailed5, natural skin texture, hyperrealism, soft light, sharp, game art, key visual, surreal",
                     "3d, cartoon, anime, sketches, worst quality, low quality, normal quality, lowres, normal quality, monochrome, grayscale, skin spots, acnes, skin blemishes, bad anatomy, girl, loli, young, large breasts, red eyes, muscular",
-                    512, 512, "6681501646976930000"
+                    512, 512, "6681501646976930000",
+                    "Euler", 25
                 ],
                 # 3-RCNZ
                 [
@@ -242,7 +495,8 @@ def ui():
                     "mm_sd_v15.ckpt", 
                     "Jane Eyre with headphones, natural skin texture,4mm,k textures, soft cinematic light, adobe lightroom, photolab, hdr, intricate, elegant, highly detailed, sharp focus, cinematic look, soothing tones, insane details, intricate details, hyperdetailed, low contrast, soft cinematic light, dim colors, exposure blend, hdr, faded",
                     "deformed, distorted, disfigured, poorly drawn, bad anatomy, wrong anatomy, extra limb, missing limb, floating limbs, mutated hands and fingers, disconnected limbs, mutation, mutated, ugly, disgusting, blurry, amputation",
-                    512, 512, "5787693165787021000"
+                    512, 512, "5787693165787021000",
+                    "Euler", 25
                 ]
                 # # 4-MajicMix
                 # [
@@ -268,7 +522,9 @@ def ui():
                 negative_prompt_textbox, 
                 width_slider, 
                 height_slider, 
-                seed_textbox
+                seed_textbox,
+                sampler_dropdown,
+                sample_step_slider,
             ],
             outputs=[
                 result_video, 
@@ -282,5 +538,5 @@ def ui():
 
 if __name__ == "__main__":
     demo = ui()
-    demo.queue(max_size=20)
+    demo.queue(concurrency_count=1, max_size=20)
     demo.launch()
@@ -103,6 +103,7 @@ def main(args):
                         pipeline = convert_lora(pipeline, state_dict, alpha=model_config.lora_alpha)
 
             pipeline.to("cuda")
+            pipeline.enable_vae_slicing()
             ### <<< create validation pipeline <<< ###
 
             prompts      = model_config.prompt